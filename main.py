@@ -7,11 +7,14 @@
 import os
 import sys
 import json
+import pickle
 import time
 import pandas as pd
 import numpy as np
 import gspread
+from gspread.utils import absolute_range_name, fill_gaps, rowcol_to_a1
 import shioaji as sj
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
 from typing import Tuple, Dict, Any, Optional
 
@@ -59,6 +62,11 @@ print("=== Loading Configuration & Secrets ===")
 FORCE_MXFR1 = True      # 強制使用近月合約代碼 (MXFR1)
 TRIM_DATA = True        # 是否修剪非交易時段數據
 QUERY_BACK_DAYS = 7     # 回補天數 (往前抓幾天)
+# MXF 合約表快取目錄 (以程式所在目錄為基準，不受 cron/Colab 的工作目錄影響；結算日不使用快取)
+CONTRACT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.contract_cache')
+
+# --- A-1. 回補抓取併發設定 (Fetch Concurrency) ---
+KBARS_FETCH_WORKERS = 4  # 逐日平行抓 K 棒的執行緒數 (Shioaji 有連線流量限制，建議 2-4)
 
 # --- B. 連線重試設定 (Retry Config) ---
 RETRY_MAX = 3
@@ -101,6 +109,9 @@ except EnvironmentError as e:
 # ==========================================
 
 from google.oauth2.service_account import Credentials
+from google.auth.transport.requests import AuthorizedSession
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 class AuthManager:
     """處理 Google Sheets 與 Shioaji 的連線"""
@@ -120,25 +131,107 @@ class AuthManager:
                 creds_dict,
                 scopes=['https://www.googleapis.com/auth/spreadsheets']
             )
-            return gspread.authorize(creds)
+
+            # 共用一個具連線池的 Session，讓後續所有 Sheets 請求重用 TCP/TLS 連線
+            session = AuthorizedSession(creds)
+            adapter = HTTPAdapter(
+                pool_connections=4, pool_maxsize=8,
+                max_retries=Retry(total=RETRY_MAX, backoff_factor=0.5)
+            )
+            session.mount("https://", adapter)
+            return gspread.Client(auth=creds, session=session)
         except Exception as e:
             raise ConnectionError(f"Google Sheet Auth Failed: {e}")
 
+    # 本次登入使用的 MXF 合約表 (唯一一份快取；每次 get_shioaji_api 登入時重設)
+    # 以 api 物件為鍵，並記錄是否由快取檔載入
+    _mxf_contracts = None
+    _mxf_contracts_api = None
+    _mxf_contracts_from_cache = False
+    _contract_cache_enabled = True
+
     @staticmethod
-    def get_shioaji_api(max_retries=RETRY_MAX, base_delay=RETRY_DELAY_BASE):
-        """建立 Shioaji API 連線 (使用全域常數)"""
+    def _contract_cache_path() -> str:
+        """當日 (台北時間) 的 MXF 合約表快取檔路徑"""
+        today = datetime.now(timezone(timedelta(hours=+8))).strftime('%Y%m%d')
+        return os.path.join(CONTRACT_CACHE_DIR, f"mxf_contracts_{today}.pkl")
+
+    @staticmethod
+    def get_mxf_contracts(api):
+        """取得 MXF 合約表：登入時已載入快取就用快取，否則取 (並記住) api.Contracts.Futures.MXF"""
+        if AuthManager._mxf_contracts is None or AuthManager._mxf_contracts_api is not api:
+            AuthManager._mxf_contracts = api.Contracts.Futures.MXF
+            AuthManager._mxf_contracts_api = api
+            AuthManager._mxf_contracts_from_cache = False
+        return AuthManager._mxf_contracts
+
+    @staticmethod
+    def save_contract_cache(mxf_contracts):
+        """
+        [合約快取] 僅在合約查找成功後呼叫：先寫暫存檔再 os.replace 原子替換，
+        並清除前幾日的舊快取檔。
+        """
+        if AuthManager._mxf_contracts_from_cache or not AuthManager._contract_cache_enabled:
+            return  # 本次就是從快取載入 (或結算日停用快取)，不需寫入
+
+        cache_path = AuthManager._contract_cache_path()
+        tmp_path = cache_path + '.tmp'
+        try:
+            os.makedirs(CONTRACT_CACHE_DIR, exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(mxf_contracts, f)
+            os.replace(tmp_path, cache_path)
+
+            for name in os.listdir(CONTRACT_CACHE_DIR):
+                old_path = os.path.join(CONTRACT_CACHE_DIR, name)
+                if name.startswith('mxf_contracts_') and name.endswith('.pkl') and old_path != cache_path:
+                    os.remove(old_path)
+        except Exception as e:
+            print(f"[Cache] Warning: 無法寫入合約快取: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @staticmethod
+    def get_shioaji_api(max_retries=RETRY_MAX, base_delay=RETRY_DELAY_BASE, use_contract_cache=True):
+        """
+        建立 Shioaji API 連線 (使用全域常數)
+        use_contract_cache=False (結算日) 時一律重新下載合約，並清除當日快取，避免沿用換月前的 MXFR1。
+        """
         api = sj.Shioaji()
 
+        # --- [Contract Cache] 當日已有快取就略過合約下載 ---
+        cached_contracts = None
+        cache_path = AuthManager._contract_cache_path()
+        AuthManager._contract_cache_enabled = use_contract_cache
+        if not use_contract_cache:
+            print("[Auth] 今日為結算日，略過合約快取並重新下載合約。")
+            if os.path.exists(cache_path):
+                os.remove(cache_path)
+        elif os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'rb') as f:
+                    cached_contracts = pickle.load(f)
+            except Exception as e:
+                print(f"[Auth] Warning: 合約快取讀取失敗，改為重新下載。錯誤: {e}")
+
         print("[Auth] Logging into Shioaji...")
         try:
             api.login(
                 api_key=SHIOAJI_API_KEY,      # 直接使用常數
                 secret_key=SHIOAJI_SECRET_KEY, # 直接使用常數
+                fetch_contract=cached_contracts is None,
                 contracts_cb=lambda security_type: print(f"{repr(security_type)} fetch done.")
             )
         except Exception as e:
             raise ConnectionError(f"Shioaji Login Failed: {e}")
 
+        # 每次登入都重設合約表快取，避免沿用前一次登入的結果
+        AuthManager._mxf_contracts = cached_contracts
+        AuthManager._mxf_contracts_api = api
+        AuthManager._mxf_contracts_from_cache = cached_contracts is not None
+        if cached_contracts is not None:
+            print(f"[Auth] Using cached MXF contracts: {cache_path}")
+
         # --- [Smart Retry] 檢查 API 用量 ---
         for attempt in range(1, max_retries + 1):
             try:
@@ -171,23 +264,28 @@ class SettleManager:
     def _load_config(self) -> pd.DataFrame:
         """讀取結算設定表"""
         try:
-            worksheet = self.gc.open_by_key(GSHEET_ID_SETTLE).worksheet(TAB_NAME_SETTLE)
-            data = worksheet.get_all_values()
+            # 直接以分頁名稱讀取整個範圍，省去 worksheet() 的額外 metadata 請求
+            spreadsheet = self.gc.open_by_key(GSHEET_ID_SETTLE)
+            data = fill_gaps(spreadsheet.values_get(absolute_range_name(TAB_NAME_SETTLE)).get('values', []))
             df = pd.DataFrame(data[1:], columns=data[0])
 
             # 資料型態轉換
             cols_to_numeric = ['next_contract_diff', 'accumulated_contract_diff']
-            for col in cols_to_numeric:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
+            df[cols_to_numeric] = df[cols_to_numeric].apply(pd.to_numeric, errors='coerce')
 
             cols_to_datetime = ['start_k', 'settle_k']
-            for col in cols_to_datetime:
-                df[col] = pd.to_datetime(df[col], errors='coerce')
+            df[cols_to_datetime] = df[cols_to_datetime].apply(pd.to_datetime, errors='coerce')
 
             return df.dropna(subset=['contract_year_month'])
         except Exception as e:
             raise RuntimeError(f"Error loading settle config: {e}")
 
+    def is_settle_day(self, when: Optional[datetime] = None) -> bool:
+        """判斷當日 (台北時間) 是否為任一合約的結算日 (含預測的下個結算日)"""
+        when = when or datetime.now(timezone(timedelta(hours=+8)))
+        settle_dates = set(self.df_config['settle_k'].dropna().dt.date)
+        return when.date() in settle_dates
+
     def calculate_next_contract(self) -> str:
         """計算下一個合約代碼 (MXF+YM)"""
         last_row = self.df_config.iloc[-1]
@@ -199,9 +297,8 @@ class SettleManager:
 
         # 2. 推算下個結算日 (該月第三個週三)
         first_day = datetime(new_ym_dt.year, new_ym_dt.month, 1)
-        third_wed = first_day + pd.DateOffset(weeks=2)
-        while third_wed.weekday() != 2:
-            third_wed += timedelta(days=1)
+        first_wed_offset = (2 - first_day.weekday()) % 7
+        third_wed = first_day + timedelta(days=first_wed_offset + 14)
 
         new_settle_k = third_wed + timedelta(hours=13, minutes=25)
         new_start_k = last_row['settle_k'] + timedelta(minutes=5)
@@ -230,6 +327,26 @@ class SettleManager:
 class DataProcessor:
     """處理 K 棒資料的清洗、重取樣、價差調整與完整性檢查"""
 
+    @staticmethod
+    def _market_date_labels(idx: pd.DatetimeIndex, is_night: bool) -> pd.Index:
+        """[向量化] 依盤別開始日產生 date_market_type (例: 251015D / 251015N)"""
+        if not is_night:
+            return idx.strftime('%y%m%d') + 'D'
+        # 只有在凌晨 (00:00-05:00) 且是夜盤時，才需要減一天；格式只取日期，故不必先 normalize
+        values = idx.values
+        shifted = np.where(idx.hour.to_numpy() < 5, values - np.timedelta64(1, 'D'), values)
+        return pd.DatetimeIndex(shifted).strftime('%y%m%d') + 'N'
+
+    @staticmethod
+    def _session_group_ids(idx: pd.DatetimeIndex) -> np.ndarray:
+        """[向量化] 盤別分組代碼 (例: 2025-10-15_D)，非交易時段標記為 UNKNOWN"""
+        hours = idx.hour.to_numpy()
+        is_dawn = hours < 5
+        suffix = np.select([(hours >= 8) & (hours <= 13), hours >= 15, is_dawn], ['_D', '_N', '_N'], default='')
+        dates = idx.normalize().to_numpy() + np.where(is_dawn, np.timedelta64(-1, 'D'), np.timedelta64(0, 'D'))
+        group_ids = np.char.add(pd.DatetimeIndex(dates).strftime('%Y-%m-%d').to_numpy(dtype=str), suffix)
+        return np.where(suffix == '', 'UNKNOWN', group_ids)
+
     @staticmethod
     def fetch_and_parse_kbars(api, contract_code: str, days_back: int) -> pd.DataFrame:
         """從 Shioaji 抓取資料"""
@@ -237,21 +354,40 @@ class DataProcessor:
         end_date = now.strftime("%Y-%m-%d")
         start_date = (now - timedelta(days=days_back)).strftime('%Y-%m-%d')
 
+        # 只查一次合約表：指定合約不存在時退回 MXFR1
+        mxf_contracts = AuthManager.get_mxf_contracts(api)
         target_code = "MXFR1" if FORCE_MXFR1 else contract_code
-        if not FORCE_MXFR1 and not api.Contracts.Futures.MXF[target_code]:
+        contract = mxf_contracts[target_code]
+        if not contract:
              target_code = "MXFR1"
+             contract = mxf_contracts[target_code]
+
+        # 合約確實查得到才寫入當日快取 (避免把尚未下載完成的合約表存一整天)
+        if contract:
+            AuthManager.save_contract_cache(mxf_contracts)
 
         print(f"[Action] Fetching {target_code} from {start_date} to {end_date}...")
 
-        contract = api.Contracts.Futures.MXF[target_code]
-        kbars = api.kbars(contract, start=start_date, end=end_date)
+        # 拆成每天一個請求平行送出，再依日期順序串接
+        days = [(now - timedelta(days=d)).strftime('%Y-%m-%d') for d in range(days_back, -1, -1)]
+        with ThreadPoolExecutor(max_workers=KBARS_FETCH_WORKERS) as executor:
+            daily_kbars = list(executor.map(lambda day: api.kbars(contract, start=day, end=day), days))
 
-        df = pd.DataFrame({**kbars}).drop(columns=["Amount"])
+        kbars_all = {}
+        for kbars in daily_kbars:
+            for key, values in {**kbars}.items():
+                kbars_all.setdefault(key, []).extend(values)
+
+        df = pd.DataFrame(kbars_all).drop(columns=["Amount"], errors="ignore")
         if df.empty:
             return df, target_code
 
+        # 台指期價格為整數點、成交量遠小於 2^31，改用 float32/int32 減半後續重取樣的記憶體
+        df = df.astype({'Open': 'float32', 'High': 'float32', 'Low': 'float32', 'Close': 'float32', 'Volume': 'int32'})
+
         df['ts'] = pd.to_datetime(df['ts'])
         df = df.set_index("ts").sort_index()
+        df = df[~df.index.duplicated(keep='last')]
 
         return df, target_code
 
@@ -259,63 +395,87 @@ class DataProcessor:
     def resample_and_split(df_raw: pd.DataFrame, df_settle_config: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
         """Resample, Split D/N, Back Adjust, Add Metadata"""
 
+        ohlcv_agg = {'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last', 'Volume': 'sum'}
+
         # 1. 轉 5分K
-        df_5m = df_raw.resample('5min', label="left", closed='right').agg({
-            'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last', 'Volume': 'sum'
-        }).dropna()
+        df_5m = df_raw.resample('5min', label="left", closed='right').agg(ohlcv_agg).dropna()
 
         # 2. 分切日盤/夜盤
-        df_5m_D = df_5m.between_time(MARKET_HOURS["D"]["open"], MARKET_HOURS["D"]["close"]).copy()
-        df_5m_N = df_5m.between_time(MARKET_HOURS["N"]["open"], MARKET_HOURS["N"]["close"]).copy()
+        # 以「當日分鐘數」整數遮罩取代 between_time (含頭含尾；夜盤跨午夜時改用 OR)
+        minutes = (df_5m.index.hour * 60 + df_5m.index.minute).to_numpy()
+
+        def session_mask(hours):
+            open_h, open_m = map(int, hours["open"].split(':'))
+            close_h, close_m = map(int, hours["close"].split(':'))
+            open_min, close_min = open_h * 60 + open_m, close_h * 60 + close_m
+            if open_min <= close_min:
+                return (minutes >= open_min) & (minutes <= close_min)
+            return (minutes >= open_min) | (minutes <= close_min)
+
+        df_5m_D = df_5m[session_mask(MARKET_HOURS["D"])]
+        df_5m_N = df_5m[session_mask(MARKET_HOURS["N"])]
 
         # 3. 轉 60分K
-        df_60m_D = df_5m_D.resample("60min", offset="45min").agg({
-            'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last', 'Volume': 'sum'
-        }).dropna()
+        # 直接把每根 5分K 對應到所屬小時的起點 (日盤以 xx:45 為界、夜盤以整點為界) 再 groupby，
+        # 省去 resample 產生跨日空 bin 的成本
+        def to_60min(df_part, offset_minutes):
+            offset = np.timedelta64(offset_minutes, 'm')
+            bucket = (df_part.index.values - offset).astype('datetime64[h]') + offset
+            bucket = pd.DatetimeIndex(bucket.astype('datetime64[ns]'), name=df_part.index.name)
+            return df_part.groupby(bucket).agg(ohlcv_agg).dropna()
 
-        df_60m_N = df_5m_N.resample("60min").agg({
-            'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last', 'Volume': 'sum'
-        }).dropna()
+        df_60m_D = to_60min(df_5m_D, 45)
+        df_60m_N = to_60min(df_5m_N, 0)
 
         # --- 補回 date_market_type (依據盤別開始日) ---
-        def get_market_date_str(ts, is_night=False):
-            target_ts = ts
-            # 只有在凌晨 (00:00-05:00) 且是夜盤時，才需要減一天
-            if is_night and ts.hour < 5:
-                target_ts = ts - timedelta(days=1)
-            suffix = "N" if is_night else "D"
-            return target_ts.strftime("%y%m%d") + suffix
-
-        for df_temp, is_night in [(df_5m_D, False), (df_5m_N, True), (df_60m_D, False), (df_60m_N, True)]:
-             if not df_temp.empty:
-                 df_temp['date_market_type'] = df_temp.index.to_series().apply(lambda x: get_market_date_str(x, is_night))
+        # 以 assign 一次產生帶標籤的新表，不需事先 .copy() 切片
+        def with_market_date(df_part, is_night):
+            return df_part.assign(date_market_type=lambda x: DataProcessor._market_date_labels(x.index, is_night))
+
+        df_5m_D, df_60m_D = with_market_date(df_5m_D, False), with_market_date(df_60m_D, False)
+        df_5m_N, df_60m_N = with_market_date(df_5m_N, True), with_market_date(df_60m_N, True)
 
         # 4. 價差調整與欄位補全
+        # 結算表只需整理一次，5分K 與 60分K 共用同一組 NumPy 陣列
+        cfg = df_settle_config.dropna(subset=['start_k']).sort_values('start_k')
+        start_arr = cfg['start_k'].to_numpy(dtype='datetime64[ns]')
+        settle_arr = cfg['settle_k'].to_numpy(dtype='datetime64[ns]')
+        diff_arr = pd.to_numeric(cfg['accumulated_contract_diff'], errors='coerce').to_numpy(dtype=float)
+        ym_arr = cfg['contract_year_month'].to_numpy()
+
         def process_final_df(df_d, df_n):
-            df_all = pd.concat([df_d, df_n]).sort_index()
+            # 日/夜盤各自已依時間排序，合併後以穩定的 mergesort 交錯排列即可 (已有序則不排)
+            df_all = pd.concat([df_d, df_n], sort=False)
             if df_all.empty: return df_all
+            if not df_all.index.is_monotonic_increasing:
+                df_all = df_all.take(np.argsort(df_all.index.values, kind='mergesort'))
+
+            # 以 searchsorted 找出每根 K 棒所屬合約 (start_k <= ts <= settle_k)
+            ts_arr = df_all.index.values
+            pos = np.searchsorted(start_arr, ts_arr, side='right') - 1
+            valid = pos >= 0
+            if len(start_arr):
+                pos = pos.clip(0)
+                valid &= ts_arr <= settle_arr[pos]
+                matched_diff = diff_arr[pos]
+                # 價差缺漏 (空白/無法解析) 時必須中止，不可讓 NaN 轉成整數後寫入錯誤價格
+                missing = valid & np.isnan(matched_diff)
+                if missing.any():
+                    bad_yms = sorted({str(ym) for ym in ym_arr[pos][missing]})
+                    raise ValueError(f"結算表 accumulated_contract_diff 缺漏或無法解析，合約: {', '.join(bad_yms)}")
+                diff = np.where(valid, matched_diff, 0).astype(int)
+                contract_ym = np.where(valid, ym_arr[pos], "")
+            else:
+                diff = np.zeros(len(ts_arr), dtype=int)
+                contract_ym = np.full(len(ts_arr), "", dtype=object)
 
-            df_all['contract_year_month'] = ""
-            df_all['accumulated_contract_diff'] = 0
-
-            def enrich_row(row):
-                match = df_settle_config[
-                    (row.name >= df_settle_config['start_k']) &
-                    (row.name <= df_settle_config['settle_k'])
-                ]
-                res = row.copy()
-                if not match.empty:
-                    cfg = match.iloc[0]
-                    diff = int(cfg['accumulated_contract_diff'])
-                    res['accumulated_contract_diff'] = diff
-                    res['contract_year_month'] = cfg['contract_year_month']
-                    res['Open'] += diff
-                    res['High'] += diff
-                    res['Low'] += diff
-                    res['Close'] += diff
-                return res
-
-            return df_all.apply(enrich_row, axis=1)
+            df_all['contract_year_month'] = contract_ym
+            df_all['accumulated_contract_diff'] = diff
+
+            # 直接就地平移價格，不另建中間 DataFrame
+            price_cols = ['Open', 'High', 'Low', 'Close']
+            df_all[price_cols] += diff[:, None]
+            return df_all
 
         df_5m_final = process_final_df(df_5m_D, df_5m_N)
         df_60m_final = process_final_df(df_60m_D, df_60m_N)
@@ -335,27 +495,25 @@ class DataProcessor:
         if timeframe not in EXPECTED or df.empty: return df
 
         # 1. 取得最後一筆資料的盤別分組
-        last_ts = df.index[-1]
-
-        # 定義分組邏輯 (Local function to avoid repetition)
-        def get_group_id(ts):
-            if 8 <= ts.hour <= 13: return ts.strftime('%Y-%m-%d') + '_D'
-            elif ts.hour >= 15: return ts.strftime('%Y-%m-%d') + '_N'
-            elif ts.hour < 5: return (ts - timedelta(days=1)).strftime('%Y-%m-%d') + '_N'
-            return 'UNKNOWN'
-
-        last_group_id = get_group_id(last_ts)
+        last_group_id = DataProcessor._session_group_ids(df.index[-1:])[0]
 
         # 2. 判斷當下時間是否就是該盤 (是否正在進行中)
         now = datetime.now(timezone(timedelta(hours=+8)))
-        current_active_id = get_group_id(now)
+        current_active_id = DataProcessor._session_group_ids(pd.DatetimeIndex([now.replace(tzinfo=None)]))[0]
 
         # 3. 檢查筆數
-        # 為了效能，只抓最後 200 筆來判斷即可
-        df_tail = df.iloc[-200:].copy()
-        df_tail['group'] = df_tail.index.to_series().apply(get_group_id)
-
-        last_group_count = len(df_tail[df_tail['group'] == last_group_id])
+        # 為了效能，只抓最後 200 筆來判斷即可；直接以時段與盤別日期遮罩計數，不產生字串標籤
+        tail_idx = df.index[-200:]
+        hours = tail_idx.hour.to_numpy()
+        is_dawn = hours < 5
+        session_dates = tail_idx.normalize().to_numpy() - np.where(is_dawn, np.timedelta64(1, 'D'), np.timedelta64(0, 'D'))
+        if last_group_id.endswith('_D'):
+            in_session = (hours >= 8) & (hours <= 13)
+        elif last_group_id.endswith('_N'):
+            in_session = (hours >= 15) | is_dawn
+        else:
+            in_session = np.zeros(len(hours), dtype=bool)
+        last_group_count = int((in_session & (session_dates == session_dates[-1])).sum())
         expected_count = EXPECTED[timeframe].get(last_group_id.split('_')[-1], 0)
 
         # 4. 決策：如果是「正在進行中」且「筆數不足」，則丟棄
@@ -375,26 +533,15 @@ class DataProcessor:
         if timeframe not in EXPECTED or df.empty: return
 
         print(f"[Check] Verifying data completeness for {timeframe}...")
-        ts_series = df.index.to_series()
-
-        def get_group_id(ts):
-            if 8 <= ts.hour <= 13: return ts.strftime('%Y-%m-%d') + '_D'
-            elif ts.hour >= 15: return ts.strftime('%Y-%m-%d') + '_N'
-            elif ts.hour < 5:
-                prev_date = ts - timedelta(days=1)
-                return prev_date.strftime('%Y-%m-%d') + '_N'
-            return 'UNKNOWN'
-
-        groups = ts_series.apply(get_group_id)
-        counts = groups.value_counts()
-        errors = []
-
-        for group_id, count in counts.items():
-            if 'UNKNOWN' in group_id: continue
-            market_type = group_id.split('_')[-1]
-            expected_count = EXPECTED[timeframe][market_type]
-            if count != expected_count:
-                errors.append(f"  - {group_id}: 預期 {expected_count} 筆, 實際 {count} 筆")
+        groups = DataProcessor._session_group_ids(df.index)
+        group_ids, counts = np.unique(groups[groups != 'UNKNOWN'], return_counts=True)
+        expected_counts = np.where(np.char.endswith(group_ids, '_D'), EXPECTED[timeframe]['D'], EXPECTED[timeframe]['N'])
+
+        bad = counts != expected_counts
+        errors = [
+            f"  - {group_id}: 預期 {expected_count} 筆, 實際 {count} 筆"
+            for group_id, expected_count, count in zip(group_ids[bad], expected_counts[bad], counts[bad])
+        ]
 
         if errors:
             raise ValueError(f"資料完整性檢查失敗 ({timeframe})，停止上傳！\n" + "\n".join(errors))
@@ -408,24 +555,86 @@ class SheetUploader:
     """處理 Google Sheets 的寫入與上傳邏輯"""
 
     @staticmethod
-    def get_last_timestamp(gc, tab_name: str) -> Optional[pd.Timestamp]:
-        """[新增] 讀取 Google Sheet 上最後一筆資料的時間"""
+    def read_tails(spreadsheet, tab_names: list) -> Dict[str, list]:
+        """
+        一次讀取多個分頁的表頭與最後一列，回傳 {tab_name: [headers, last_row]} (格式同 get_all_values 的頭尾)。
+        以 ts 欄的長度定位最後一列，避免把整張表傳回來；ts 在 A 欄時所有分頁共用兩次 batchGet。
+        """
+        # 1. 表頭 + A 欄 (所有分頁合併成一個請求；本程式寫入時 ts 固定在 A 欄)
+        ranges = []
+        for tab_name in tab_names:
+            ranges += [absolute_range_name(tab_name, '1:1'), absolute_range_name(tab_name, 'A:A')]
+        value_ranges = spreadsheet.values_batch_get(ranges)['valueRanges']
+
+        tails, ts_col_lengths, misplaced_ts = {}, {}, {}
+        for i, tab_name in enumerate(tab_names):
+            headers = value_ranges[2 * i].get('values', [[]])[0]
+            tails[tab_name] = [headers] if headers else []
+            if 'ts' in headers and headers.index('ts') != 0:
+                misplaced_ts[tab_name] = headers.index('ts')
+            else:
+                ts_col_lengths[tab_name] = len(value_ranges[2 * i + 1].get('values', []))
+
+        # 1.1 ts 不在 A 欄的分頁 (手動建立的表)，改讀實際的 ts 欄來定位最後一列
+        if misplaced_ts:
+            ts_ranges = []
+            for tab_name, ts_idx in misplaced_ts.items():
+                col_letter = rowcol_to_a1(1, ts_idx + 1)[:-1]
+                ts_ranges.append(absolute_range_name(tab_name, f"{col_letter}:{col_letter}"))
+            ts_values = spreadsheet.values_batch_get(ts_ranges)['valueRanges']
+            for tab_name, value_range in zip(misplaced_ts, ts_values):
+                ts_col_lengths[tab_name] = len(value_range.get('values', []))
+
+        last_row_nums = {
+            tab_name: n for tab_name, n in ts_col_lengths.items() if tails[tab_name] and n >= 2
+        }
+
+        # 2. 各分頁最後一列 (同樣合併成一個請求)
+        if last_row_nums:
+            last_ranges = [absolute_range_name(tab, f"{n}:{n}") for tab, n in last_row_nums.items()]
+            last_values = spreadsheet.values_batch_get(last_ranges)['valueRanges']
+            for tab_name, value_range in zip(last_row_nums, last_values):
+                tails[tab_name].append(value_range.get('values', [[]])[0])
+
+        return tails
+
+    @staticmethod
+    def prefetch_tails(gc, tab_names: list) -> Tuple[Any, Dict[str, list]]:
+        """
+        [預先讀取] 在上傳流程開始前開啟資料試算表並一次取得所有分頁的頭尾，回傳 (spreadsheet, tails)。
+        失敗時對應項目為 None / 空 dict，由各步驟自行重新開啟與讀取。
+        """
+        try:
+            spreadsheet = gc.open_by_key(GSHEET_ID_DATA)
+        except Exception as e:
+            print(f"[Warning] Open data spreadsheet failed, fallback to per-tab reads: {e}")
+            return None, {}
+
+        try:
+            return spreadsheet, SheetUploader.read_tails(spreadsheet, tab_names)
+        except Exception as e:
+            print(f"[Warning] Batch read of {tab_names} failed, fallback to per-tab reads: {e}")
+            return spreadsheet, {}
+
+    @staticmethod
+    def get_last_timestamp(gc, tab_name: str, existing_data: Optional[list] = None) -> Optional[pd.Timestamp]:
+        """[新增] 讀取 Google Sheet 上最後一筆資料的時間 (可傳入預先讀取的頭尾資料)"""
         try:
-            worksheet = gc.open_by_key(GSHEET_ID_DATA).worksheet(tab_name)
-            # 為了效能，我們只抓最後幾列來判斷即可，不需要抓整張表
-            # 但考慮到可能表是空的，我們用安全的方法
-            all_values = worksheet.get_all_values()
+            if existing_data is None:
+                spreadsheet = gc.open_by_key(GSHEET_ID_DATA)
+                spreadsheet.worksheet(tab_name)  # 分頁不存在時拋出 WorksheetNotFound
+                # 為了效能，只抓表頭與最後一列來判斷即可，不需要抓整張表
+                existing_data = SheetUploader.read_tails(spreadsheet, [tab_name])[tab_name]
 
-            if len(all_values) < 2: # 只有標頭或空的
+            if len(existing_data) < 2: # 只有標頭或空的
                 return None
 
-            # 假設第一欄是 ts (根據 _prepare_data 的邏輯)
-            headers = all_values[0]
+            headers = existing_data[0]
             if 'ts' not in headers:
                 return None
 
             ts_idx = headers.index('ts')
-            last_row = all_values[-1]
+            last_row = existing_data[-1]
             last_ts_str = last_row[ts_idx]
 
             return pd.to_datetime(last_ts_str)
@@ -435,55 +644,61 @@ class SheetUploader:
             return None
 
     @staticmethod
-    def _prepare_data(df_new: pd.DataFrame, existing_data: list) -> Tuple[pd.DataFrame, bool]:
-        """[純邏輯] 資料清洗與比對"""
-        df_process = df_new.copy()
-        if df_process.index.name == 'ts':
-             df_process.reset_index(inplace=True)
+    def _prepare_data(df_new: pd.DataFrame, existing_data: list) -> Tuple[list, np.ndarray, bool]:
+        """[純邏輯] 資料清洗與比對，回傳 (欄位, 2-D object 陣列, 是否需寫表頭)"""
+        available_cols = ['ts'] + [c for c in df_new.columns if c != 'ts']
+
+        def to_object_array(cols, mask):
+            # 先篩選再格式化 ts；逐欄填入預先配置的 object 陣列，之後只需一次 tolist()
+            ts_str = df_new.index[mask].strftime('%Y-%m-%d %H:%M:%S').to_numpy()
+            arr = np.empty((len(ts_str), len(cols)), dtype=object)
+            for j, col in enumerate(cols):
+                arr[:, j] = ts_str if col == 'ts' else df_new[col].to_numpy()[mask]
+            return arr
 
-        # 確保 ts 是字串格式以便上傳
-        if 'ts' in df_process.columns:
-             df_process['ts'] = pd.to_datetime(df_process['ts']).dt.strftime('%Y-%m-%d %H:%M:%S')
+        all_rows = np.ones(len(df_new), dtype=bool)
+        nothing = ([], np.empty((0, 0), dtype=object), False)
 
         # A. 空表
         if not existing_data:
-            cols = ['ts'] + [c for c in df_process.columns if c != 'ts']
-            return df_process[cols], True
+            return available_cols, to_object_array(available_cols, all_rows), True
 
         # B. 只有表頭
         headers = existing_data[0]
+        valid_cols = [c for c in headers if c in available_cols]
         if len(existing_data) == 1:
-            valid_cols = [c for c in headers if c in df_process.columns]
-            return df_process[valid_cols], False
+            return valid_cols, to_object_array(valid_cols, all_rows), False
 
         # C. 正常更新 (這裡其實已經在 Main 做過過濾了，但保留著當雙重保險)
         try:
             ts_col_idx = headers.index('ts') if 'ts' in headers else 0
             last_ts_str = existing_data[-1][ts_col_idx]
-            last_ts = pd.to_datetime(last_ts_str)
+            last_ts = pd.Timestamp(last_ts_str)
 
-            current_ts_series = pd.to_datetime(df_process['ts'])
-            df_to_upload = df_process[current_ts_series > last_ts].copy()
+            # 直接比對 datetime64 數值，不必先格式化成字串再解析回來
+            mask = df_new.index.values > np.datetime64(last_ts)
+            if not mask.any():
+                return nothing
 
-            if df_to_upload.empty:
-                return pd.DataFrame(), False
-
-            valid_cols = [c for c in headers if c in df_to_upload.columns]
-            return df_to_upload[valid_cols], False
+            return valid_cols, to_object_array(valid_cols, mask), False
         except Exception as e:
             print(f"[Error] Data preparation failed: {e}")
-            return pd.DataFrame(), False
+            return nothing
 
     @staticmethod
-    def append_safely(gc, tab_name: str, df_new: pd.DataFrame):
-        """[I/O 操作] 連線並執行上傳 (使用全域常數 GSHEET_ID_DATA)"""
+    def append_safely(gc, tab_name: str, df_new: pd.DataFrame,
+                      existing_data: Optional[list] = None, spreadsheet=None):
+        """[I/O 操作] 連線並執行上傳 (使用全域常數 GSHEET_ID_DATA)，可傳入預先開啟的試算表與頭尾資料"""
         if df_new.empty:
             print(f"[{tab_name}] No new data to upload (Filter blocked).")
             return
 
         try:
-            worksheet = gc.open_by_key(GSHEET_ID_DATA).worksheet(tab_name)
-            existing_data = worksheet.get_all_values()
+            if spreadsheet is None:
+                spreadsheet = gc.open_by_key(GSHEET_ID_DATA)
+            if existing_data is None:
+                spreadsheet.worksheet(tab_name)  # 分頁不存在時拋出 WorksheetNotFound
+                existing_data = SheetUploader.read_tails(spreadsheet, [tab_name])[tab_name]
         except gspread.WorksheetNotFound:
             print(f"[{tab_name}] Worksheet not found. Creating new...")
             # 這裡簡單處理：如果找不到就當作空表，但通常應該要先手動建好
@@ -492,17 +707,22 @@ class SheetUploader:
             print(f"[Error] Google Sheet Connection failed: {e}")
             return
 
-        df_export, needs_header = SheetUploader._prepare_data(df_new, existing_data)
+        export_cols, export_values, needs_header = SheetUploader._prepare_data(df_new, existing_data)
 
-        if not df_export.empty:
-            print(f"[{tab_name}] Uploading {len(df_export)} rows...")
-            data_to_write = df_export.values.tolist()
+        if len(export_values):
+            print(f"[{tab_name}] Uploading {len(export_values)} rows...")
+            data_to_write = export_values.tolist()
             if needs_header:
-                print(f"[{tab_name}] Detect empty sheet. Writing headers first.")
-                data_to_write = [df_export.columns.tolist()] + data_to_write
+                print(f"[{tab_name}] Detect empty sheet. Writing headers in the same request.")
+                data_to_write = [export_cols] + data_to_write
 
             try:
-                worksheet.append_rows(data_to_write)
+                # 表頭與資料合併為單一 values.append 請求；RAW 避免 Sheets 端再解析字串
+                spreadsheet.values_append(
+                    absolute_range_name(tab_name, 'A1'),
+                    params={'valueInputOption': 'RAW', 'insertDataOption': 'INSERT_ROWS'},
+                    body={'values': data_to_write}
+                )
                 print(f"[{tab_name}] Upload Success.")
             except Exception as e:
                 print(f"[{tab_name}] Upload Failed: {e}")
@@ -527,7 +747,8 @@ if __name__ == "__main__":
         target_contract = settle_mgr.calculate_next_contract()
 
         # 3. API 抓取
-        api = AuthManager.get_shioaji_api()
+        # 結算日換月，合約表必須重新下載
+        api = AuthManager.get_shioaji_api(use_contract_cache=not settle_mgr.is_settle_day())
         df_raw, used_code = DataProcessor.fetch_and_parse_kbars(api, target_contract, QUERY_BACK_DAYS)
         api.logout()
 
@@ -545,8 +766,11 @@ if __name__ == "__main__":
             # 這樣舊日期的資料缺漏 (如 01-12) 就會被這裡濾掉，不會觸發 Error
             # ================================================================
 
+            # 兩個分頁的表頭與最後一列一次讀回，過濾與上傳共用
+            data_spreadsheet, sheet_tails = SheetUploader.prefetch_tails(gc, [TAB_NAME_5MIN, TAB_NAME_60MIN])
+
             def filter_new_only(df, tab_name):
-                last_ts = SheetUploader.get_last_timestamp(gc, tab_name)
+                last_ts = SheetUploader.get_last_timestamp(gc, tab_name, sheet_tails.get(tab_name))
                 if last_ts is not None and not df.empty:
                     original_count = len(df)
                     # 保留 index 時間大於 Sheet 最後時間的資料
@@ -561,25 +785,22 @@ if __name__ == "__main__":
             df_5m = filter_new_only(df_5m, TAB_NAME_5MIN)
             df_60m = filter_new_only(df_60m, TAB_NAME_60MIN)
 
-            # 5. 完整性檢查
+            # 5. 完整性檢查 (兩張表都先通過檢查，才開始上傳)
             # (現在這裡只會檢查「真正要上傳」的新資料，舊的壞資料已經被濾掉了)
-            if not df_5m.empty:
-                DataProcessor.check_completeness(df_5m, '5min')
-                # 補上代碼
-                df_5m['MXF_code'] = used_code
-                # 6. 上傳
-                SheetUploader.append_safely(gc, TAB_NAME_5MIN, df_5m)
-            else:
-                print(f"[{TAB_NAME_5MIN}] All data is up-to-date. Skipping check & upload.")
-
-            if not df_60m.empty:
-                DataProcessor.check_completeness(df_60m, '60min')
-                # 補上代碼
-                df_60m['MXF_code'] = used_code
-                # 6. 上傳
-                SheetUploader.append_safely(gc, TAB_NAME_60MIN, df_60m)
-            else:
-                print(f"[{TAB_NAME_60MIN}] All data is up-to-date. Skipping check & upload.")
+            upload_jobs = []
+            for tab_name, df, timeframe in [(TAB_NAME_5MIN, df_5m, '5min'), (TAB_NAME_60MIN, df_60m, '60min')]:
+                if not df.empty:
+                    DataProcessor.check_completeness(df, timeframe)
+                    # 補上代碼
+                    df['MXF_code'] = used_code
+                    upload_jobs.append((tab_name, df, sheet_tails.get(tab_name), data_spreadsheet))
+                else:
+                    print(f"[{tab_name}] All data is up-to-date. Skipping check & upload.")
+
+            # 6. 上傳 (不同分頁彼此獨立，平行送出以重疊網路等待時間)
+            if upload_jobs:
+                with ThreadPoolExecutor(max_workers=len(upload_jobs)) as executor:
+                    list(executor.map(lambda job: SheetUploader.append_safely(gc, *job), upload_jobs))
 
         else:
             print("[Warning] No data fetched from API.")